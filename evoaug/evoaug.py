@@ -1,6 +1,7 @@
 import torch
 from pytorch_lightning.core.lightning import LightningModule
 import numpy as np
+from evoaug.augment import random_dna
 
 
 class RobustModel(LightningModule):
@@ -150,12 +151,10 @@ class RobustModel(LightningModule):
 
     def _pad_end(self, x):
         """Add random DNA padding of length insert_max to the end of each sequence in batch, x.
+        The padding is sampled from the global random number generator (seeded with torch.manual_seed).
         """
-        N, A, L = x.shape
-        a = torch.eye(A)
-        p = torch.tensor([1/A for _ in range(A)])
-        padding = torch.stack([a[p.multinomial(self.insert_max, replacement=True)].transpose(0,1) for _ in range(N)]).to(x.device)
-        x_padded = torch.cat( [x, padding.to(x.device)], dim=2 )
+        padding = random_dna(x, self.insert_max)  # sampled on x's device, in x's dtype
+        x_padded = torch.cat( [x, padding], dim=-1 )
         return x_padded
 
 
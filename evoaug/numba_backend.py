@@ -0,0 +1,126 @@
+"""
+Numba-compiled CPU kernels for EvoAug augmentations.
+
+When augmentations run on the CPU (e.g. within DataLoader workers), these kernels
+apply an augmentation to a whole batch in a single compiled pass, without the
+overhead of dispatching many small PyTorch operations. Each kernel operates on
+numpy views of the one-hot sequences (shape: (N, A, L)) and on the lengths, start
+indices and random DNA that were already sampled by the corresponding class in
+augment.py, so both paths produce identical results for the same random state.
+The kernels copy contiguous segments of each sequence directly and never build
+the per-position index used by the PyTorch path.
+
+This module requires numba, which is an optional dependency of EvoAug.
+"""
+import numpy as np
+from numba import njit, prange
+
+
+@njit(parallel=True, cache=True)
+def delete_batch(x, padding, delete_lens, delete_inds):
+    """Delete a segment from each sequence in a batch and pad it with random DNA.
+
+    :param x: Batch of sequences (shape: (N, A, L))
+    :param padding: Random DNA split between the beginning and end of each sequence (shape: (N, A, delete_max))
+    :param delete_lens: Length of the deletion in each sequence (shape: (N,))
+    :param delete_inds: Start index of the deletion in each sequence (shape: (N,))
+    :return: sequences with deletions (shape: (N, A, L))
+
+    """
+    N, A, L = x.shape
+    x_aug = np.empty_like(x)
+    for n in prange(N):
+        d = delete_lens[n]
+        s = delete_inds[n]
+        pad_begin = d // 2
+        seq_end = pad_begin + L - d
+        x_aug[n, :, :pad_begin] = padding[n, :, :pad_begin]
+        x_aug[n, :, pad_begin:pad_begin+s] = x[n, :, :s]
+        x_aug[n, :, pad_begin+s:seq_end] = x[n, :, s+d:]
+        x_aug[n, :, seq_end:] = padding[n, :, pad_begin:d]
+    return x_aug
+
+
+@njit(parallel=True, cache=True)
+def insert_batch(x, padding, insert_lens, insert_inds):
+    """Insert a segment of random DNA into each sequence in a batch and pad it with random DNA.
+
+    :param x: Batch of sequences (shape: (N, A, L))
+    :param padding: Random DNA for the insertion and padding of each sequence (shape: (N, A, insert_max))
+    :param insert_lens: Length of the insertion in each sequence (shape: (N,))
+    :param insert_inds: Index of the insertion in each sequence (shape: (N,))
+    :return: sequences with insertions (shape: (N, A, L + insert_max))
+
+    """
+    N, A, L = x.shape
+    K = padding.shape[2]
+    x_aug = np.empty((N, A, L + K), dtype=x.dtype)
+    for n in prange(N):
+        d = insert_lens[n]
+        s = insert_inds[n]
+        b = (K - d) // 2
+        x_aug[n, :, :b] = padding[n, :, :b]
+        x_aug[n, :, b:b+s] = x[n, :, :s]
+        x_aug[n, :, b+s:b+s+d] = padding[n, :, b:b+d]
+        x_aug[n, :, b+s+d:b+d+L] = x[n, :, s:]
+        x_aug[n, :, b+d+L:] = padding[n, :, b+d:]
+    return x_aug
+
+
+@njit(parallel=True, cache=True)
+def translocate_batch(x, shifts):
+    """Roll each sequence in a batch by its own shift.
+
+    :param x: Batch of sequences (shape: (N, A, L))
+    :param shifts: Shift of each sequence, positive or negative (shape: (N,))
+    :return: rolled sequences (shape: (N, A, L))
+
+    """
+    N, A, L = x.shape
+    x_aug = np.empty_like(x)
+    for n in prange(N):
+        s = shifts[n] % L
+        x_aug[n, :, s:] = x[n, :, :L-s]
+        x_aug[n, :, :s] = x[n, :, L-s:]
+    return x_aug
+
+
+@njit(parallel=True, cache=True)
+def invert_batch(x, inversion_lens, inversion_inds):
+    """Reverse-complement a segment of each sequence in a batch, in a single pass.
+
+    :param x: Batch of sequences (shape: (N, A, L))
+    :param inversion_lens: Length of the inversion in each sequence (shape: (N,))
+    :param inversion_inds: Start index of the inversion in each sequence (shape: (N,))
+    :return: sequences with inversions (shape: (N, A, L))
+
+    """
+    N, A, L = x.shape
+    x_aug = np.empty_like(x)
+    for n in prange(N):
+        s = inversion_inds[n]
+        e = s + inversion_lens[n]
+        x_aug[n, :, :s] = x[n, :, :s]
+        for a in range(A):
+            for i in range(e - s):
+                x_aug[n, a, s+i] = x[n, A-1-a, e-1-i]
+        x_aug[n, :, e:] = x[n, :, e:]
+    return x_aug
+
+
+@njit(parallel=True, cache=True)
+def mutate_batch(x, mutation_inds, mutations):
+    """Overwrite a set of positions in each sequence in a batch with random nucleotides.
+
+    :param x: Batch of sequences (shape: (N, A, L))
+    :param mutation_inds: Positions to mutate in each sequence (shape: (N, K))
+    :param mutations: Random DNA written at the mutated positions (shape: (N, A, K))
+    :return: mutated sequences
+
+    """
+    N, A, L = x.shape
+    x_aug = x.copy()
+    for n in prange(N):
+        for k in range(mutation_inds.shape[1]):
+            x_aug[n, :, mutation_inds[n, k]] = mutations[n, :, k]
+    return x_aug
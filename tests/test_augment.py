@@ -0,0 +1,330 @@
+import pytest
+import torch
+import torch.nn.functional as F
+from evoaug import augment
+
+
+N, L = 16, 100
+
+
+def random_onehot(N, L):
+    return F.one_hot(torch.randint(4, (N, L)), 4).transpose(1,2).float().contiguous()
+
+
+def fixed_params(N, low, high, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randint(low, high, (N,), generator=generator)
+
+
+def apply_index(x, padding, augment_obj, *params):
+    """Apply the index map of a PermuteGatherAug to a batch for fixed parameters."""
+    if padding is not None:
+        x = torch.cat([x, padding], -1)
+    index, complement = augment_obj.build_index(x.shape[-1] - augment_obj.pad_len, *params)
+    x_aug = augment._gather(x, index)
+    if complement is not None:
+        x_aug = augment._where(complement, augment._complement(x_aug), x_aug)
+    return x_aug
+
+
+#------------------------------------------------------------------------
+# RandomDeletion
+#------------------------------------------------------------------------
+
+
+def loop_deletion(x, padding, delete_lens, delete_inds):
+    """Original per-sequence loop, except that the end padding continues from the
+    beginning padding in the random DNA."""
+    x_aug = []
+    for seq, pad, delete_len, delete_ind in zip(x, padding, delete_lens, delete_inds):
+        pad_begin_index = torch.div(delete_len, 2, rounding_mode='floor').item()
+        x_aug.append( torch.cat([pad[:,:pad_begin_index],
+                                 seq[:,:delete_ind],
+                                 seq[:,delete_ind+delete_len:],
+                                 pad[:,pad_begin_index:delete_len]],
+                                -1))
+    return torch.stack(x_aug)
+
+
+def test_deletion_index():
+    x, padding = random_onehot(N, L), random_onehot(N, 30)
+    delete_lens = torch.cat([torch.tensor([0, 30]), fixed_params(N-2, 0, 31)])
+    delete_inds = torch.cat([torch.tensor([0, L-30]), fixed_params(N-2, 0, L-30+1, seed=1)])
+    x_aug = apply_index(x, padding, augment.RandomDeletion(0, 30), delete_lens, delete_inds)
+    assert torch.equal(x_aug, loop_deletion(x, padding, delete_lens, delete_inds))
+
+
+#------------------------------------------------------------------------
+# RandomTranslocation
+#------------------------------------------------------------------------
+
+
+def loop_translocation(x, shifts):
+    return torch.stack([torch.roll(seq, shift.item(), -1) for seq, shift in zip(x, shifts)])
+
+
+def test_translocation_index():
+    x = random_onehot(N, L)
+    shifts = torch.cat([torch.tensor([0, 30, -30]), fixed_params(N-3, -30, 31)])
+    x_aug = apply_index(x, None, augment.RandomTranslocation(0, 30), shifts)
+    assert torch.equal(x_aug, loop_translocation(x, shifts))
+
+
+#------------------------------------------------------------------------
+# RandomInversion
+#------------------------------------------------------------------------
+
+
+def loop_inversion(x, inversion_lens, inversion_inds):
+    x_aug = []
+    for seq, inversion_len, inversion_ind in zip(x, inversion_lens, inversion_inds):
+        x_aug.append( torch.cat([seq[:,:inversion_ind],
+                                 torch.flip(seq[:,inversion_ind:inversion_ind+inversion_len], dims=[0,1]),
+                                 seq[:,inversion_ind+inversion_len:]],
+                                -1))
+    return torch.stack(x_aug)
+
+
+def test_inversion_index():
+    x = random_onehot(N, L)
+    inversion_lens = torch.cat([torch.tensor([0, 30]), fixed_params(N-2, 0, 31)])
+    inversion_inds = torch.cat([torch.tensor([0, L-30]), fixed_params(N-2, 0, L-30+1, seed=1)])
+    x_aug = apply_index(x, None, augment.RandomInversion(0, 30), inversion_lens, inversion_inds)
+    assert torch.equal(x_aug, loop_inversion(x, inversion_lens, inversion_inds))
+
+
+#------------------------------------------------------------------------
+# RandomMutation
+#------------------------------------------------------------------------
+
+
+def replay_generator(seed=0):
+    """Returns a generator in the state that an augmentation draws from after
+    torch.manual_seed(seed), as augmentations reseed from the global generator."""
+    torch.manual_seed(seed)
+    return torch.Generator().manual_seed(int(torch.randint(2**62, ())))
+
+
+def loop_mutation(x, mutation_inds, mutations):
+    x_aug = torch.clone(x)
+    for i in range(x.shape[0]):
+        x_aug[i,:,mutation_inds[i]] = mutations[i]
+    return x_aug
+
+
+def test_mutation():
+    x = random_onehot(N, L)
+    torch.manual_seed(0)
+    x_aug = augment.RandomMutation(mutate_frac=0.1)(x)
+
+    # replay the draws of the augmentation and apply them with the original loop
+    generator = replay_generator()
+    num_mutations = round(0.1 / 0.75 * L)
+    mutation_inds = torch.topk(torch.rand(N, L, generator=generator), num_mutations, dim=1, sorted=False).indices
+    mutations = F.one_hot(torch.randint(0, 4, (N, num_mutations), generator=generator), 4).transpose(1,2).float()
+    assert torch.equal(x_aug, loop_mutation(x, mutation_inds, mutations))
+
+    # mutations are written at distinct positions and leave the rest of each sequence unchanged
+    assert all(len(set(inds.tolist())) == num_mutations for inds in mutation_inds)
+    unchanged = torch.ones(N, L, dtype=torch.bool).scatter_(1, mutation_inds, False)
+    assert torch.equal(x_aug.transpose(1,2)[unchanged], x.transpose(1,2)[unchanged])
+
+
+#------------------------------------------------------------------------
+# RandomInsertion
+#------------------------------------------------------------------------
+
+
+def loop_insertion(x, insertions, insert_lens, insert_inds):
+    insert_max = insertions.shape[-1]
+    x_aug = []
+    for seq, insertion, insert_len, insert_ind in zip(x, insertions, insert_lens, insert_inds):
+        insert_beginning_len = torch.div((insert_max - insert_len), 2, rounding_mode='floor').item()
+        x_aug.append( torch.cat([insertion[:,:insert_beginning_len],
+                                 seq[:,:insert_ind],
+                                 insertion[:,insert_beginning_len:insert_beginning_len+insert_len],
+                                 seq[:,insert_ind:],
+                                 insertion[:,insert_beginning_len+insert_len:insert_max]],
+                                -1))
+    return torch.stack(x_aug)
+
+
+def test_insertion_index():
+    x, insertions = random_onehot(N, L), random_onehot(N, 30)
+    insert_lens = torch.cat([torch.tensor([0, 30]), fixed_params(N-2, 0, 31)])
+    insert_inds = torch.cat([torch.tensor([0, L-1]), fixed_params(N-2, 0, L, seed=1)])
+    x_aug = apply_index(x, insertions, augment.RandomInsertion(0, 30), insert_lens, insert_inds)
+    assert torch.equal(x_aug, loop_insertion(x, insertions, insert_lens, insert_inds))
+
+
+#------------------------------------------------------------------------
+# RandomNoise
+#------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize('dtype, dtype_aug', [(torch.float32, torch.float32), (torch.float64, torch.float64),
+                                              (torch.uint8, torch.float32), (torch.int64, torch.float32)])
+def test_noise(dtype, dtype_aug):
+    x = random_onehot(64, 1000).to(dtype)
+    x_aug = augment.RandomNoise(noise_mean=0.5, noise_std=0.2)(x)
+    assert x_aug.dtype == dtype_aug and x_aug.shape == x.shape
+    noise = x_aug - x
+    assert abs(noise.mean().item() - 0.5) < 0.01
+    assert abs(noise.std().item() - 0.2) < 0.01
+
+
+def test_noise_index_form():
+    with pytest.raises(ValueError):
+        augment.RandomNoise()(augment.pack_onehot(random_onehot(N, L)))
+
+
+#------------------------------------------------------------------------
+# RandomRC
+#------------------------------------------------------------------------
+
+
+def loop_rc(x, ind_rc):
+    x_aug = torch.clone(x)
+    x_aug[ind_rc] = torch.flip(x_aug[ind_rc], dims=[1,2])
+    return x_aug
+
+
+@pytest.mark.parametrize('rc_prob', [0.0, 0.5, 1.0])
+def test_rc(rc_prob):
+    x = random_onehot(N, L)
+    torch.manual_seed(0)
+    x_aug = augment.RandomRC(rc_prob=rc_prob)(x)
+
+    # replay the draw of the augmentation and apply it with the original implementation
+    ind_rc = torch.rand(N, generator=replay_generator()) < rc_prob
+    assert torch.equal(x_aug, loop_rc(x, ind_rc))
+
+
+#------------------------------------------------------------------------
+# numba backend
+#------------------------------------------------------------------------
+
+
+AUGMENTATIONS = [
+    lambda: augment.RandomDeletion(delete_min=0, delete_max=30),
+    lambda: augment.RandomInsertion(insert_min=0, insert_max=30),
+    lambda: augment.RandomTranslocation(shift_min=0, shift_max=30),
+    lambda: augment.RandomInversion(invert_min=0, invert_max=30),
+    lambda: augment.RandomMutation(mutate_frac=0.1),
+    lambda: augment.RandomRC(rc_prob=0.5),
+]
+
+
+@pytest.mark.parametrize('make_augment', AUGMENTATIONS[:5])
+def test_numba(make_augment, monkeypatch):
+    pytest.importorskip('numba')
+    x = random_onehot(N, L)
+    torch.manual_seed(0)
+    x_torch = make_augment()(x)
+    monkeypatch.setattr(augment, 'use_numba', True)
+    torch.manual_seed(0)
+    x_numba = make_augment()(x)
+    assert torch.equal(x_numba, x_torch)
+
+
+def test_numba_disabled():
+    assert not augment.use_numba
+    assert not augment._use_numba(random_onehot(N, L))
+
+
+#------------------------------------------------------------------------
+# Nucleotide-index batches
+#------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize('make_augment', AUGMENTATIONS)
+@pytest.mark.parametrize('dtype', [torch.uint8, torch.int8])
+def test_index_form(make_augment, dtype):
+    x = random_onehot(N, L)
+    torch.manual_seed(0)
+    x_aug = make_augment()(x)
+    torch.manual_seed(0)
+    x_index = make_augment()(augment.pack_onehot(x).to(dtype))
+    assert x_index.dtype == dtype
+    assert torch.equal(augment.unpack_onehot(x_index), x_aug)
+
+
+
+#------------------------------------------------------------------------
+# Compose
+#------------------------------------------------------------------------
+
+
+def test_compose_compiled():
+    # one compiled graph serves all batch sizes and sequence lengths
+    torch._dynamo.reset()
+    augment_obj = augment.Compose([augment.RandomDeletion(), augment.RandomInsertion(), augment.RandomTranslocation(),
+                                   augment.RandomInversion(), augment.RandomMutation(), augment.RandomRC()],
+                                  mode='default')
+    for L in range(100, 112):
+        x = random_onehot(L % 5 + 2, L)
+        assert augment_obj(x).shape == (L % 5 + 2, 4, L + 30)
+    x_index = augment_obj(augment.pack_onehot(random_onehot(N, L)))
+    assert x_index.dtype == torch.uint8 and x_index.shape == (N, L + 30)
+
+
+#------------------------------------------------------------------------
+# RobustModel
+#------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize('dtype', [torch.float32, torch.float16, torch.bfloat16])
+def test_pad_end(dtype):
+    evoaug = pytest.importorskip('evoaug.evoaug')
+    robust_model = evoaug.RobustModel(torch.nn.Identity(), torch.nn.MSELoss(), None,
+                                      augment_list=[augment.RandomInsertion(insert_max=20)])
+    x = random_onehot(N, L).to(dtype)
+    x_padded = robust_model._pad_end(x)
+    assert x_padded.dtype == dtype and x_padded.shape == (N, 4, L + 20)
+    assert torch.equal(x_padded[:,:,:L], x)
+    assert torch.all(x_padded[:,:,L:].sum(dim=1) == 1)
+
+
+#------------------------------------------------------------------------
+# Random number generators
+#------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize('make_augment', AUGMENTATIONS + [lambda: augment.RandomNoise()])
+def test_reseed(make_augment):
+    x = random_onehot(N, L)
+    augment_obj = make_augment()
+    torch.manual_seed(0)
+    x_aug = augment_obj(x)
+    torch.manual_seed(0)
+    assert torch.equal(augment_obj(x), x_aug)
+    assert not torch.equal(augment_obj(x), x_aug)
+
+
+def test_compose_reseed():
+    x = random_onehot(N, L)
+    augment_obj = augment.Compose([augment.RandomDeletion(), augment.RandomInsertion(), augment.RandomMutation()],
+                                  compile=False)
+    torch.manual_seed(0)
+    x_aug = augment_obj(x)
+    torch.manual_seed(0)
+    assert torch.equal(augment_obj(x), x_aug)
+
+
+#------------------------------------------------------------------------
+# pack_onehot / unpack_onehot
+#------------------------------------------------------------------------
+
+
+def test_pack_onehot():
+    x = random_onehot(N, L)
+    x_index = augment.pack_onehot(x)
+    assert x_index.dtype == torch.uint8 and x_index.shape == (N, L)
+    assert torch.equal(augment.unpack_onehot(x_index), x)
+    assert augment.unpack_onehot(x_index, dtype=torch.float16).dtype == torch.float16
+
+
+def test_pack_onehot_lossy():
+    # all-zero positions pack to A, soft positions to their most likely nucleotide
+    x = torch.tensor([[[0., 0.1], [0., 0.2], [0., 0.6], [0., 0.1]]])
+    assert augment.pack_onehot(x).tolist() == [[0, 2]]